@@ -1,103 +1,143 @@
 import os
-import re
+import mmap
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Plots are only ever saved to files
 import matplotlib.pyplot as plt
 import numpy as np
-from datetime import datetime
 import time
 import sys
 import glob
+import concurrent.futures
+from logical_clock_simulation import EVT_SEND, EVT_RECV, read_event_records
+
+EVENT_TYPES = ['INTERNAL', 'SEND', 'RECEIVE']
+_INTERNAL_CODE, _SEND_CODE, _RECEIVE_CODE = range(len(EVENT_TYPES))
+
+# Event records look like
+# "2025-03-05 14:29:23.f - RECEIVE from 56314 - System time: 1741202963.077844, Queue length: 0, Logical clock: 4"
+_SYSTEM_TIME_SEP = b' - System time: '
+# Event kind by the text before its last word ("INTERNAL EVENT", "SEND to 5002", ...);
+# for internal events that word must be "EVENT"
+_INTERNAL_WORD = b'EVENT'
+_EVENT_LABELS = {b'INTERNAL': _INTERNAL_CODE, b'SEND to': _SEND_CODE, b'RECEIVE from': _RECEIVE_CODE}
+_QUEUE_PREFIX = b'Queue length: '
+_CLOCK_PREFIX = b'Logical clock: '
+
+def _iter_lines(log_file):
+    """Yield the raw lines of a log file from a read-only memory map"""
+    with open(log_file, 'rb') as f:
+        # mmap can't map an empty file, which simply has no lines
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from iter(mm.readline, b'')
 
 def parse_log_file(log_file):
     """Parse a machine log file and extract timestamp, event type, and logical clock values"""
-    data = []
+    # Column-wise buffers; optional fields are NaN for events that don't carry them
+    timestamps, system_times, event_codes, logical_clocks = [], [], [], []
+    targets, sources, queue_lengths = [], [], []
     
-    with open(log_file, 'r') as f:
-        for line in f:
-            # Parse timestamp - handle various timestamp formats
-            timestamp_match = re.search(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?:\.\w+)?', line)
-            if not timestamp_match:
-                continue
-            
-            timestamp_str = timestamp_match.group(1)
-            timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-            
-            # Skip startup and configuration lines
-            if "Starting machine" in line or "Internal event range" in line or "shutdown" in line:
-                continue
-            
-            # Extract system time
-            system_time_match = re.search(r'System time: (\d+\.\d+)', line)
-            if system_time_match:
-                system_time = float(system_time_match.group(1))
-            else:
-                system_time = None
-                continue  # Skip lines without system time
-            
-            # Extract event type
-            if "INTERNAL EVENT" in line:
-                event_type = "INTERNAL"
-            elif "SEND to" in line:
-                event_type = "SEND"
-                # Extract target
-                target_match = re.search(r'SEND to (\d+)', line)
-                if target_match:
-                    target = int(target_match.group(1))
-                else:
-                    target = None
-            elif "RECEIVE from" in line:
-                event_type = "RECEIVE"
-                # Extract source
-                source_match = re.search(r'RECEIVE from (\d+)', line)
-                if source_match:
-                    source = int(source_match.group(1))
-                else:
-                    source = None
-                
-                # Extract queue length
-                queue_match = re.search(r'Queue length: (\d+)', line)
-                if queue_match:
-                    queue_length = int(queue_match.group(1))
-                else:
-                    queue_length = None
-            else:
+    # The format is fixed, so split on its literal separators instead of
+    # running a regex; only the extracted fields are ever decoded
+    for line in _iter_lines(log_file):
+        head, sep, fields = line.partition(_SYSTEM_TIME_SEP)
+        if not sep:
+            continue  # Skip startup, configuration and shutdown lines
+        
+        stamp, _, kind = head.partition(b' - ')
+        system_time, _, rest = fields.partition(b', ')
+        target = source = queue_length = np.nan
+        try:
+            # One split yields both the event kind and its port, if any
+            label, _, port = kind.rpartition(b' ')
+            event_code = _EVENT_LABELS.get(label)
+            if event_code is None:
                 continue  # Skip lines with unknown event types
+            if event_code == _INTERNAL_CODE:
+                if port != _INTERNAL_WORD:
+                    continue  # Skip malformed internal event lines
+            elif event_code == _SEND_CODE:
+                target = int(port)
+            elif event_code == _RECEIVE_CODE:
+                source = int(port)
+                if rest.startswith(_QUEUE_PREFIX):
+                    queue_field, _, rest = rest.partition(b', ')
+                    queue_length = int(queue_field[len(_QUEUE_PREFIX):])
             
-            # Extract logical clock
-            clock_match = re.search(r'Logical clock: (\d+)', line)
-            if clock_match:
-                logical_clock = int(clock_match.group(1))
-            else:
+            if not rest.startswith(_CLOCK_PREFIX):
                 continue  # Skip lines without logical clock
-            
-            # Create data entry
-            entry = {
-                'timestamp': timestamp,
-                'system_time': system_time,
-                'event_type': event_type,
-                'logical_clock': logical_clock
-            }
-            
-            # Add event-specific fields
-            if event_type == "SEND":
-                entry['target'] = target
-            elif event_type == "RECEIVE":
-                entry['source'] = source
-                entry['queue_length'] = queue_length
-            
-            data.append(entry)
+            logical_clock = int(rest[len(_CLOCK_PREFIX):])
+            system_time = float(system_time)
+        except ValueError:
+            continue  # Skip malformed lines
+        
+        # ISO-8601 timestamps sort lexicographically, so keep the raw string
+        timestamps.append(stamp[:19].decode('ascii'))
+        system_times.append(system_time)
+        event_codes.append(event_code)
+        logical_clocks.append(logical_clock)
+        targets.append(target)
+        sources.append(source)
+        queue_lengths.append(queue_length)
     
     # Create a DataFrame with default columns even if data is empty
-    if not data:
+    if not timestamps:
         print(f"Warning: No valid log entries found in {log_file}")
         return pd.DataFrame(columns=['timestamp', 'system_time', 'event_type', 'logical_clock'])
     
-    return pd.DataFrame(data)
+    return pd.DataFrame({
+        'timestamp': timestamps,
+        'system_time': np.asarray(system_times, dtype=np.float64),
+        'event_type': pd.Categorical.from_codes(np.asarray(event_codes, dtype=np.int8), EVENT_TYPES),
+        'logical_clock': np.asarray(logical_clocks, dtype=np.int64),
+        'target': np.asarray(targets, dtype=np.float64),
+        'source': np.asarray(sources, dtype=np.float64),
+        'queue_length': np.asarray(queue_lengths, dtype=np.float64)
+    })
+
+def parse_event_file(event_file):
+    """Load a binary machine event log into the same columns parse_log_file produces"""
+    records = read_event_records(event_file)
+    if not len(records):
+        print(f"Warning: No valid log entries found in {event_file}")
+        return pd.DataFrame(columns=['timestamp', 'system_time', 'event_type', 'logical_clock'])
+    
+    is_send = records['event'] == EVT_SEND
+    is_recv = records['event'] == EVT_RECV
+    event_codes = np.select([is_send, is_recv], [_SEND_CODE, _RECEIVE_CODE], _INTERNAL_CODE)
+    port = records['port'].astype(np.float64)
+    
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(records['system_time'], unit='s'),
+        'system_time': records['system_time'],
+        'event_type': pd.Categorical.from_codes(event_codes.astype(np.int8), EVENT_TYPES),
+        'logical_clock': records['logical_clock'].astype(np.int64),
+        'target': np.where(is_send, port, np.nan),
+        'source': np.where(is_recv, port, np.nan),
+        'queue_length': np.where(is_recv, records['queue_length'].astype(np.float64), np.nan)
+    })
 
 def analyze_log_data(machine_dfs, run_name=""):
     """Analyze the log data from multiple machines"""
     print(f"=== Analysis for run: {run_name} ===")
     
+    # Logs are written chronologically, so one stable sort up front makes every
+    # later pass order-safe without re-sorting
+    machine_dfs = {m: df.sort_values('timestamp', kind='mergesort').reset_index(drop=True)
+                   for m, df in machine_dfs.items()}
+    
+    # Logical clock jumps for all machines in one grouped pass
+    jump_frames = [df[['logical_clock']].assign(machine_id=m) for m, df in machine_dfs.items()
+                   if len(df) > 1 and 'logical_clock' in df.columns]
+    if jump_frames:
+        combined = pd.concat(jump_frames, ignore_index=True)
+        combined['clock_jump'] = combined.groupby('machine_id')['logical_clock'].diff()
+        jump_stats = combined.groupby('machine_id')['clock_jump'].agg(['max', 'mean'])
+    else:
+        jump_stats = pd.DataFrame(columns=['max', 'mean'])
+    
     empty_data = True
     
     # Print basic statistics for each machine
@@ -112,25 +152,20 @@ def analyze_log_data(machine_dfs, run_name=""):
         
         if 'event_type' in df.columns:
             event_counts = df['event_type'].value_counts()
+            event_counts = event_counts[event_counts > 0]  # Categoricals report unseen types too
             for event_type, count in event_counts.items():
                 print(f"  {event_type} events: {count} ({count/len(df)*100:.1f}%)")
         else:
             print("  Warning: No event type data found in log")
         
         if 'queue_length' in df.columns and not df['queue_length'].isna().all():
-            max_queue = df['queue_length'].max()
-            avg_queue = df['queue_length'].mean()
-            print(f"  Maximum queue length: {max_queue}")
-            print(f"  Average queue length: {avg_queue:.2f}")
+            queue_stats = df['queue_length'].agg(['max', 'mean'])
+            print(f"  Maximum queue length: {queue_stats['max']}")
+            print(f"  Average queue length: {queue_stats['mean']:.2f}")
         
-        # Calculate logical clock jumps
-        if len(df) > 1 and 'logical_clock' in df.columns:
-            df = df.sort_values('timestamp')
-            df['clock_jump'] = df['logical_clock'].diff()
-            max_jump = df['clock_jump'].max()
-            avg_jump = df['clock_jump'].mean()
-            print(f"  Maximum logical clock jump: {max_jump}")
-            print(f"  Average logical clock jump: {avg_jump:.2f}")
+        if machine_id in jump_stats.index:
+            print(f"  Maximum logical clock jump: {jump_stats.at[machine_id, 'max']}")
+            print(f"  Average logical clock jump: {jump_stats.at[machine_id, 'mean']:.2f}")
     
     if empty_data:
         print("\nNo valid data found for analysis. Check log files or run duration.")
@@ -143,7 +178,6 @@ def analyze_log_data(machine_dfs, run_name=""):
         if df.empty or 'logical_clock' not in df.columns or 'system_time' not in df.columns:
             continue
             
-        df = df.sort_values('timestamp')
         plt.plot(df['system_time'], df['logical_clock'], label=f'Machine {machine_id}')
     
     plt.xlabel('System Time (s)')
@@ -154,50 +188,70 @@ def analyze_log_data(machine_dfs, run_name=""):
     
     # Save the plot
     os.makedirs('analysis', exist_ok=True)
-    plt.savefig(f'analysis/logical_clock_progression_{run_name}.png')
+    plt.savefig(f'analysis/logical_clock_progression_{run_name}.png', dpi=100)
+    plt.close()
     
-    # Calculate clock drift between machines
-    machines_with_data = [m for m, df in machine_dfs.items() 
-                         if not df.empty and 'logical_clock' in df.columns]
+    # Calculate clock drift between machines from each one's final logical clock value
+    final_clocks = [(m, df['logical_clock'].iat[-1]) for m, df in machine_dfs.items()
+                    if not df.empty and 'logical_clock' in df.columns]
     
-    if len(machines_with_data) > 1:
+    if len(final_clocks) > 1:
         print("\nClock Drift Analysis:")
         
-        for i in range(len(machines_with_data)):
-            for j in range(i+1, len(machines_with_data)):
-                machine_a = machines_with_data[i]
-                machine_b = machines_with_data[j]
-                
-                # Get final logical clock values
-                final_a = machine_dfs[machine_a].sort_values('timestamp').iloc[-1]['logical_clock']
-                final_b = machine_dfs[machine_b].sort_values('timestamp').iloc[-1]['logical_clock']
-                
+        for i in range(len(final_clocks)):
+            machine_a, final_a = final_clocks[i]
+            for j in range(i+1, len(final_clocks)):
+                machine_b, final_b = final_clocks[j]
                 drift = abs(final_a - final_b)
                 print(f"  Drift between Machine {machine_a} and Machine {machine_b}: {drift}")
 
 def analyze_run(run_dir):
     """Analyze all machine logs for a specific run"""
     machine_dfs = {}
+    to_parse = []
     
-    log_files_found = False
-    for log_file in os.listdir(run_dir):
-        if log_file.startswith('machine_') and log_file.endswith('.log'):
-            log_files_found = True
-            machine_id = int(log_file.split('_')[1].split('.')[0])
-            log_path = os.path.join(run_dir, log_file)
-            
-            # Check if file is empty
-            if os.path.getsize(log_path) == 0:
-                print(f"Warning: Log file {log_file} is empty")
-                machine_dfs[machine_id] = pd.DataFrame(columns=['timestamp', 'system_time', 'event_type', 'logical_clock'])
+    # Machines write binary events to machine_N.bin; older runs only have the
+    # text events in machine_N.log, so fall back to that when there's no .bin
+    log_entries = {}
+    # scandir hands back cached type and size info with each directory entry
+    with os.scandir(run_dir) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if not stem.startswith('machine_') or ext not in ('.log', '.bin'):
                 continue
-                
-            try:
-                df = parse_log_file(log_path)
-                machine_dfs[machine_id] = df
-            except Exception as e:
-                print(f"Error parsing log file {log_file}: {e}")
-                machine_dfs[machine_id] = pd.DataFrame(columns=['timestamp', 'system_time', 'event_type', 'logical_clock'])
+            machine_part = stem[len('machine_'):]
+            if not machine_part.isdigit() or not entry.is_file():
+                continue
+            
+            machine_id = int(machine_part)
+            if ext == '.bin' or machine_id not in log_entries:
+                log_entries[machine_id] = entry
+    
+    log_files_found = bool(log_entries)
+    for machine_id, entry in log_entries.items():
+        log_file = entry.name
+        
+        # Check if file is empty
+        if entry.stat().st_size == 0:
+            print(f"Warning: Log file {log_file} is empty")
+            machine_dfs[machine_id] = pd.DataFrame(columns=['timestamp', 'system_time', 'event_type', 'logical_clock'])
+            continue
+        
+        parser = parse_event_file if log_file.endswith('.bin') else parse_log_file
+        machine_dfs[machine_id] = None  # Keep directory order; filled in below
+        to_parse.append((machine_id, log_file, parser, entry.path))
+    
+    # Each log parses independently, so spread them across processes
+    if to_parse:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(len(to_parse), os.cpu_count() or 1)) as executor:
+            futures = [(machine_id, log_file, executor.submit(parser, log_path))
+                       for machine_id, log_file, parser, log_path in to_parse]
+            for machine_id, log_file, future in futures:
+                try:
+                    machine_dfs[machine_id] = future.result()
+                except Exception as e:
+                    print(f"Error parsing log file {log_file}: {e}")
+                    machine_dfs[machine_id] = pd.DataFrame(columns=['timestamp', 'system_time', 'event_type', 'logical_clock'])
     
     if not log_files_found:
         print(f"No log files found in directory: {run_dir}")
@@ -211,9 +265,10 @@ def find_experiment_dirs():
     experiment_dirs = []
     
     # Look for experiment_* directories
-    for dir_name in os.listdir('.'):
-        if os.path.isdir(dir_name) and (dir_name.startswith('experiment_') or dir_name.startswith('logs_')):
-            experiment_dirs.append(dir_name)
+    with os.scandir('.') as entries:
+        for entry in entries:
+            if entry.name.startswith(('experiment_', 'logs_')) and entry.is_dir():
+                experiment_dirs.append(entry.name)
     
     return sorted(experiment_dirs)
 
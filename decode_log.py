@@ -0,0 +1,37 @@
+import sys
+from datetime import datetime
+from logical_clock_simulation import EVT_SEND, EVT_RECV, EVT_INTERNAL, read_event_records
+
+def format_event(record):
+    """Render one binary event record in the text log format"""
+    system_time = float(record['system_time'])
+    timestamp = datetime.fromtimestamp(system_time).strftime('%Y-%m-%d %H:%M:%S.%f')
+    event = record['event']
+    if event == EVT_SEND:
+        # A broadcast to every other machine has target port 0 (BROADCAST_PORT),
+        # kept numeric so analyze_results can parse the line back
+        kind = f"SEND to {record['port']}"
+    elif event == EVT_RECV:
+        kind = f"RECEIVE from {record['port']}"
+    elif event == EVT_INTERNAL:
+        kind = "INTERNAL EVENT"
+    else:
+        kind = f"UNKNOWN EVENT {event}"
+
+    line = f"{timestamp} - {kind} - System time: {system_time:.6f}, "
+    if event == EVT_RECV:
+        line += f"Queue length: {record['queue_length']}, "
+    return line + f"Logical clock: {record['logical_clock']}"
+
+def main():
+    """Print the events of one or more binary machine logs as text"""
+    if len(sys.argv) < 2:
+        print("Usage: python decode_log.py <machine_N.bin> [...]")
+        return
+
+    for path in sys.argv[1:]:
+        for record in read_event_records(path):
+            print(format_event(record))
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,81 @@
 import socket
-import threading
+import struct
+import asyncio
 import time
 import random
 import logging
+import logging.handlers
+import mmap
 import os
+import sys
 import multiprocessing
-from queue import Empty
+import multiprocessing.connection
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+from functools import partial
+from collections import deque
+import numpy as np
 from datetime import datetime
 
+# Event types recorded in the binary event log
+EVT_SEND = 1
+EVT_RECV = 2
+EVT_INTERNAL = 3
+
+# Message payload: the sender's logical clock as a little-endian int64
+CLOCK_MESSAGE = struct.Struct("<q")
+
+# Port recorded for a SEND that went to every other machine at once
+BROADCAST_PORT = 0
+
+# One fixed-size record per event:
+# <event:u8><pad:u8><port:u16><queue_length:u32><system_time:f64><logical_clock:i64>
+EVENT_RECORD = struct.Struct("<BxHIdq")
+EVENT_DTYPE = np.dtype(
+    [
+        ("event", "u1"),
+        ("pad", "u1"),
+        ("port", "<u2"),
+        ("queue_length", "<u4"),
+        ("system_time", "<f8"),
+        ("logical_clock", "<i8"),
+    ]
+)
+assert EVENT_DTYPE.itemsize == EVENT_RECORD.size
+
+
+def read_event_records(path):
+    """Load the event records of a binary machine log"""
+    records = np.fromfile(path, dtype=EVENT_DTYPE)
+    # Drop the zeroed tail a machine that was killed mid-run leaves behind
+    return records[records["event"] != 0]
+
+# Machines on one host can talk over unix datagram sockets instead of
+# loopback UDP: VM_TRANSPORT=unix|udp
+TRANSPORT = os.environ.get("VM_TRANSPORT", "udp")
+
+
+def unix_socket_path(port, suffix=""):
+    """Path of the unix datagram socket for the machine on the given port"""
+    return f"/tmp/vm_{port}{suffix}.sock"
+
+
+def machine_address(port, transport=None):
+    """Address other machines send to for the machine on the given port"""
+    if (transport or TRANSPORT) == "unix":
+        return unix_socket_path(port)
+    return ("localhost", port)
+
+
+def address_port(addr):
+    """Port of the machine at a (host, port) or unix socket address"""
+    if isinstance(addr, tuple):
+        return addr[1]
+    if not addr:
+        # Datagram from an unbound unix socket
+        return 0
+    return int(os.path.basename(addr)[3:].split(".")[0])
+
 
 def setup_logging(machine_id):
     """Set up logging for a virtual machine process"""
@@ -29,17 +97,81 @@ def setup_logging(machine_id):
         "%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S.%f"
     )
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+
+    # Batch records in memory so each event doesn't cost a write; errors still
+    # go straight to disk
+    buffered_handler = logging.handlers.MemoryHandler(
+        capacity=256, flushLevel=logging.ERROR, target=file_handler
+    )
+    logger.addHandler(buffered_handler)
 
     return logger
 
 
-def run_machine(machine, duration_seconds):
-    """Run a virtual machine in a separate process"""
+class EventLog:
+    """Append-only file of binary event records for one machine
+
+    The file is sized up front and memory-mapped, so logging a record is a
+    store into the mapping rather than a write call. close() trims the file
+    to the records actually written; a machine killed before then leaves a
+    zero-filled tail, which readers skip since no record has event 0.
+    """
+
+    _INITIAL_SIZE = (4 << 20) // EVENT_RECORD.size * EVENT_RECORD.size
+
+    def __init__(self, path):
+        flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC
+        self._fd = os.open(path, flags | getattr(os, "O_BINARY", 0), 0o644)
+        self._size = self._INITIAL_SIZE
+        os.ftruncate(self._fd, self._size)
+        self._map = mmap.mmap(self._fd, self._size)
+        self._pos = 0
+
+    def log(self, event, port, logical_clock, system_time, queue_length=0):
+        """Append one event record"""
+        if self._pos == self._size:
+            # Remap rather than mmap.resize, which needs mremap (not on macOS)
+            self._map.close()
+            self._size *= 2
+            os.ftruncate(self._fd, self._size)
+            self._map = mmap.mmap(self._fd, self._size)
+        EVENT_RECORD.pack_into(
+            self._map, self._pos, event, port, queue_length, system_time, logical_clock
+        )
+        self._pos += EVENT_RECORD.size
+
+    def close(self):
+        self._map.close()
+        os.ftruncate(self._fd, self._pos)
+        os.close(self._fd)
+
+
+def setup_event_log(machine_id):
+    """Open the binary event log for a virtual machine process"""
+    log_dir = "logs"
+    os.makedirs(log_dir, exist_ok=True)
+    return EventLog(f"{log_dir}/machine_{machine_id}.bin")
+
+
+@dataclass
+class VMConfig:
+    """Settings for one virtual machine, cheap to hand to a child process"""
+
+    machine_id: int
+    clock_rate: int
+    port: int
+    other_machines: list = field(default_factory=list)
+    internal_event_range: tuple = (4, 10)
+    transport: Optional[str] = None
+
+
+def run_machine(config, duration_seconds):
+    """Build and run a virtual machine inside its own process"""
     try:
+        machine = VirtualMachine(**asdict(config))
         machine.run(duration_seconds)
     except Exception as e:
-        logging.error(f"Error in machine {machine.machine_id}: {e}")
+        logging.error("Error in machine %s: %s", config.machine_id, e)
         raise
 
 
@@ -51,6 +183,7 @@ class VirtualMachine:
         port,
         other_machines=None,
         internal_event_range=(4, 10),
+        transport=None,
     ):
         """
         Initialize a virtual machine with a given ID, clock rate, and port.
@@ -59,164 +192,324 @@ class VirtualMachine:
             machine_id: Identifier for this machine
             clock_rate: Number of clock ticks per second (1-6)
             port: Port to listen for incoming messages
-            other_machines: List of (host, port) tuples for other machines
-            internal_event_range: Tuple (min, max) for internal event random number range
+            other_machines: List of addresses ((host, port) or unix socket path) for other machines
+            internal_event_range: Tuple (min, max) for internal event random number range;
+                only max is used: actions are drawn from 1 to max (at most 255), so max
+                sets how often internal events happen
+            transport: "udp" or "unix"; defaults to the VM_TRANSPORT environment variable
         """
         if not 0 <= port <= 65535:
             raise ValueError("Port must be between 0 and 65535")
+        if not 1 <= internal_event_range[0] <= internal_event_range[1] <= 255:
+            raise ValueError("Internal event range must satisfy 1 <= min <= max <= 255")
 
         self.machine_id = machine_id
         self.clock_rate = clock_rate
         self.port = port
-        self.logical_clock = multiprocessing.Value("i", 0)
-        self.message_queue = multiprocessing.Queue()
-        self.running = multiprocessing.Value("b", False)
+        # Only this machine's main loop touches the clock (the receiver just
+        # forwards datagrams), so a plain int needs no lock
+        self.logical_clock = 0
+        # (logical clock, source port) messages queued by the event loop
+        self.message_queue = deque()
+        # Every datagram is read into this one buffer
+        self._rx_buf = bytearray(16)
         self.other_machines = other_machines if other_machines else []
         self.internal_event_range = internal_event_range
+        self.transport = transport or TRANSPORT
+
+        # Random actions are drawn from the generator in blocks. Both are
+        # created on first use, inside the machine's own process, so every
+        # machine seeds its own generator instead of sharing a pickled copy
+        self._rng = None
+        self._action_buffer = []
+        self._action_idx = 0
 
         # Initialize sockets
         self._setup_sockets()
+        self._peer_sockets = {}
+        self._peer_addrs = {}
 
         # Set up logging for the main process
         self.logger = None
+        self.events = None
+
+    @property
+    def address(self):
+        """Address other machines send to"""
+        return machine_address(self.port, self.transport)
+
+    def _socket_paths(self):
+        return [unix_socket_path(self.port), unix_socket_path(self.port, ".out")]
 
     def _setup_sockets(self):
-        """Set up UDP sockets for communication"""
+        """Set up datagram sockets for communication"""
+        if self.transport == "unix":
+            family = socket.AF_UNIX
+            # Clear sockets left behind by a previous run
+            for path in self._socket_paths():
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        else:
+            family = socket.AF_INET
+
         # Socket for receiving messages
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.server_socket.bind(("localhost", self.port))
+        self.server_socket = socket.socket(family, socket.SOCK_DGRAM)
+        # Leave room for bursts that arrive while the receiver is draining
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.server_socket.bind(self.address)
 
         # Client socket for sending messages
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client_socket = socket.socket(family, socket.SOCK_DGRAM)
+        if self.transport == "unix":
+            # Named so receivers can tell which machine a message came from
+            self.client_socket.bind(unix_socket_path(self.port, ".out"))
+
+    def _connect_peers(self):
+        """Create one connected UDP socket per peer so sends skip the address lookup"""
+        if self.transport == "unix":
+            # Unix addresses need no lookup, and sends have to come from the
+            # named client socket
+            return
+        for peer in self.other_machines:
+            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            peer_socket.connect(self._resolve(peer))
+            self._peer_sockets[peer] = peer_socket
+
+    def _resolve(self, addr):
+        """Return the numeric sockaddr for a peer, resolving each one only once"""
+        sockaddr = self._peer_addrs.get(addr)
+        if sockaddr is None:
+            if isinstance(addr, tuple):
+                sockaddr = socket.getaddrinfo(
+                    *addr, socket.AF_INET, socket.SOCK_DGRAM
+                )[0][4]
+            else:
+                sockaddr = addr
+            self._peer_addrs[addr] = sockaddr
+        return sockaddr
+
+    def _next_action(self):
+        """Return the next random action from the pre-drawn buffer"""
+        if self._action_idx == len(self._action_buffer):
+            if self._rng is None:
+                self._rng = np.random.default_rng()
+            # A list of Python ints, so each tick skips the numpy scalar unboxing
+            self._action_buffer = self._rng.integers(
+                1, self.internal_event_range[1] + 1, size=4096, dtype=np.uint8
+            ).tolist()
+            self._action_idx = 0
+        action = self._action_buffer[self._action_idx]
+        self._action_idx += 1
+        return action
 
     def update_logical_clock(self, received_time=None):
         """Update the logical clock according to Lamport's rules"""
-        with self.logical_clock.get_lock():
-            if received_time is not None:
-                self.logical_clock.value = (
-                    max(self.logical_clock.value, received_time) + 1
-                )
+        if received_time is not None:
+            self.logical_clock = max(self.logical_clock, received_time) + 1
+        else:
+            self.logical_clock += 1
+
+    def _send(self, message, target_machine):
+        """Send an encoded message to one machine"""
+        peer_socket = self._peer_sockets.get(target_machine)
+        try:
+            if peer_socket is None:
+                self.client_socket.sendto(message, self._resolve(target_machine))
             else:
-                self.logical_clock.value += 1
+                peer_socket.send(message)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # The peer hasn't bound its socket yet or has already shut down;
+            # drop the datagram as unconnected UDP would
+            pass
 
-    def send_message(self, target_machine):
-        """Send the current logical clock value to the target machine"""
-        with self.logical_clock.get_lock():
-            current_clock = self.logical_clock.value
-            message = f"{current_clock}"
-            self.client_socket.sendto(message.encode(), target_machine)
-            self.update_logical_clock()
-            if self.logger:
-                self.logger.info(
-                    f"SEND to {target_machine[1]} - System time: {time.time():.6f}, "
-                    f"Logical clock: {self.logical_clock.value}"
-                )
-
-    def receive_messages(self):
-        """Process function to continuously receive messages"""
-        # Set up logging for this process
-        self.logger = setup_logging(self.machine_id)
+    # The event methods take the system time to log, so the run loop can read
+    # it once per tick; called directly they read it themselves
 
-        self.server_socket.settimeout(
-            0.1
-        )  # Small timeout to allow checking if still running
+    def send_message(self, target_machine, now=None):
+        """Send the current logical clock value to the target machine"""
+        if now is None:
+            now = time.time()
+        self._send(CLOCK_MESSAGE.pack(self.logical_clock), target_machine)
+        self.update_logical_clock()
+        if self.events:
+            self.events.log(
+                EVT_SEND, address_port(target_machine), self.logical_clock, now
+            )
 
-        while self.running.value:
+    def broadcast_message(self, now=None):
+        """Send the current logical clock value to all other machines as one send event"""
+        if now is None:
+            now = time.time()
+        message = CLOCK_MESSAGE.pack(self.logical_clock)
+        for target_machine in self.other_machines:
+            self._send(message, target_machine)
+        self.update_logical_clock()
+        if self.events:
+            self.events.log(EVT_SEND, BROADCAST_PORT, self.logical_clock, now)
+
+    def internal_event(self, now=None):
+        """Advance the logical clock for an internal event"""
+        if now is None:
+            now = time.time()
+        self.update_logical_clock()
+        if self.events:
+            self.events.log(EVT_INTERNAL, 0, self.logical_clock, now)
+
+    def _build_dispatch(self):
+        """Map each possible action to the event it triggers"""
+        # Anything that isn't a send, including a send with no peer to
+        # receive it, is an internal event
+        dispatch = [self.internal_event] * (max(self.internal_event_range[1], 3) + 1)
+        if len(self.other_machines) >= 1:
+            # Send to the first machine
+            dispatch[1] = partial(self.send_message, self.other_machines[0])
+        if len(self.other_machines) >= 2:
+            # Send to the second machine, or to all other machines
+            dispatch[2] = partial(self.send_message, self.other_machines[1])
+            dispatch[3] = self.broadcast_message
+        return dispatch
+
+    def _receive_messages(self):
+        """Queue every datagram waiting on the server socket"""
+        while True:
             try:
-                data, addr = self.server_socket.recvfrom(1024)
-                received_clock = int(data.decode().strip())
-                self.message_queue.put((received_clock, addr))
-            except socket.timeout:
+                nbytes, addr = self.server_socket.recvfrom_into(self._rx_buf)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if self.logger:
+                    self.logger.error("Error receiving message: %s", e)
+                return
+            if nbytes != CLOCK_MESSAGE.size:
+                if self.logger:
+                    self.logger.error("Error receiving message: %s bytes", nbytes)
                 continue
-            except Exception as e:
-                self.logger.error(f"Error receiving message: {e}")
+            try:
+                source_port = address_port(addr)
+            except ValueError:
+                # A unix sender whose socket isn't named after a machine's port
+                if self.logger:
+                    self.logger.error(
+                        "Error receiving message: unknown sender %s", addr
+                    )
+                continue
+            received_clock = CLOCK_MESSAGE.unpack_from(self._rx_buf)[0]
+            self.message_queue.append((received_clock, source_port))
+
+    def start_receiving(self):
+        """Queue datagrams from the server socket on the running event loop"""
+        self.server_socket.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.server_socket, self._receive_messages)
+
+    def stop_receiving(self):
+        """Stop watching the server socket on the running event loop"""
+        asyncio.get_running_loop().remove_reader(self.server_socket)
 
     def run(self, duration_seconds=60):
         """Run the virtual machine for the specified duration"""
+        # The receiver reads the socket itself, which needs a selector loop
+        # (Windows defaults to the proactor loop)
+        loop = asyncio.SelectorEventLoop()
+        try:
+            loop.run_until_complete(self._run(duration_seconds))
+        finally:
+            loop.close()
+
+    async def _run(self, duration_seconds):
         # Set up logging for this process
         self.logger = setup_logging(self.machine_id)
 
-        self.running.value = True
         self.logger.info(
-            f"Starting machine {self.machine_id} with clock rate {self.clock_rate} ticks/second"
+            "Starting machine %s with clock rate %s ticks/second",
+            self.machine_id,
+            self.clock_rate,
         )
-        self.logger.info(f"Internal event range: {self.internal_event_range}")
+        self.logger.info("Internal event range: %s", self.internal_event_range)
 
-        # Start the message receiver process
-        receiver_process = multiprocessing.Process(target=self.receive_messages)
-        receiver_process.daemon = True
-        receiver_process.start()
+        # Messages are received by the event loop while the tick loop sleeps
+        self.start_receiving()
 
-        start_time = time.time()
+        self.events = setup_event_log(self.machine_id)
+        self._connect_peers()
+        dispatch = self._build_dispatch()
 
-        try:
-            while time.time() - start_time < duration_seconds:
-                # Calculate sleep time based on clock rate
-                sleep_time = 1.0 / self.clock_rate
+        # Monotonic time is immune to wall-clock adjustments mid-run
+        end_time = time.monotonic() + duration_seconds
 
-                try:
-                    # Try to get a message with a small timeout
-                    received_clock, addr = self.message_queue.get(timeout=0.1)
-                    self.update_logical_clock(received_clock)
-                    queue_length = 0  # Can't reliably get queue size in multiprocessing
-                    self.logger.info(
-                        f"RECEIVE from {addr[1]} - System time: {time.time():.6f}, "
-                        f"Queue length: {queue_length}, Logical clock: {self.logical_clock.value}"
+        # Ticks are paced against fixed deadlines so time spent doing the
+        # work doesn't stretch each cycle
+        period = 1.0 / self.clock_rate
+        next_tick = time.monotonic() + period
+
+        # Bound once so each tick skips the attribute lookups
+        message_queue = self.message_queue
+        clock_rate = self.clock_rate
+        update_logical_clock = self.update_logical_clock
+        log_event = self.events.log
+        next_action = self._next_action
+
+        try:
+            while time.monotonic() < end_time:
+                # System time for every event logged this tick
+                now = time.time()
+
+                # Drain the queued burst, capped at clock_rate messages per tick
+                drained = 0
+                while drained < clock_rate and message_queue:
+                    received_clock, source_port = message_queue.popleft()
+                    update_logical_clock(received_clock)
+                    log_event(
+                        EVT_RECV,
+                        source_port,
+                        self.logical_clock,
+                        now,
+                        len(message_queue),
                     )
-                except Empty:
-                    # No message available, generate a random action
-                    action = random.randint(1, 10)
-
-                    if action == 1 and len(self.other_machines) >= 1:
-                        # Send to the first machine
-                        self.send_message(self.other_machines[0])
-                    elif action == 2 and len(self.other_machines) >= 2:
-                        # Send to the second machine
-                        self.send_message(self.other_machines[1])
-                    elif action == 3 and len(self.other_machines) >= 2:
-                        # Send to all other machines
-                        for machine in self.other_machines:
-                            self.send_message(machine)
-                    elif (
-                        self.internal_event_range[0]
-                        <= action
-                        <= self.internal_event_range[1]
-                    ):
-                        # Internal event
-                        self.update_logical_clock()
-                        self.logger.info(
-                            f"INTERNAL EVENT - System time: {time.time():.6f}, "
-                            f"Logical clock: {self.logical_clock.value}"
-                        )
-                    else:
-                        # For any other value, do nothing (in this case, it's like an internal event)
-                        self.update_logical_clock()
-                        self.logger.info(
-                            f"INTERNAL EVENT - System time: {time.time():.6f}, "
-                            f"Logical clock: {self.logical_clock.value}"
-                        )
-
-                # Sleep for the remainder of the clock cycle
-                time.sleep(sleep_time)
+                    drained += 1
+
+                if not drained:
+                    # No message available, carry out a random action
+                    dispatch[next_action()](now)
+
+                # Sleep for the remainder of the clock cycle, but not past the
+                # end of the run; even a late tick yields once so pending
+                # datagrams get queued
+                tick_end = time.monotonic()
+                await asyncio.sleep(max(min(next_tick, end_time) - tick_end, 0))
+                # After a stall, restart from now rather than racing to catch up
+                next_tick = max(next_tick + period, tick_end)
 
         finally:
-            self.running.value = False
-            receiver_process.terminate()
-            receiver_process.join(timeout=1.0)
+            self.stop_receiving()
             self.server_socket.close()
             self.client_socket.close()
-            self.logger.info(f"Machine {self.machine_id} shutdown")
+            for peer_socket in self._peer_sockets.values():
+                peer_socket.close()
+            if self.transport == "unix":
+                for path in self._socket_paths():
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+            self.events.close()
+            self.logger.info("Machine %s shutdown", self.machine_id)
+            for handler in self.logger.handlers:
+                handler.flush()
 
 
 def run_simulation(
     duration_seconds=60, num_machines=3, max_clock_rate=6, internal_event_range=(4, 10)
 ):
     """Set up and run the simulation with multiple machines"""
-    if __name__ != "__main__":
-        # When running in a test, we need to use spawn method for process creation
-        multiprocessing.set_start_method("spawn", force=True)
+    # Fork skips re-importing this module in every child, but is only safe on
+    # Linux; elsewhere keep the platform default (spawn on macOS and Windows)
+    ctx = multiprocessing.get_context(
+        "fork" if sys.platform.startswith("linux") else None
+    )
 
-    machines = []
+    configs = []
     processes = []
     base_port = 5000
 
@@ -229,35 +522,42 @@ def run_simulation(
         logging.root.removeHandler(handler)
 
     try:
-        # Create the virtual machines
+        # Describe the virtual machines; each one opens its own sockets in
+        # its own process
         for i in range(num_machines):
             # Random clock rate between 1 and max_clock_rate
             clock_rate = random.randint(1, max_clock_rate)
             port = base_port + i
-            machines.append(
-                VirtualMachine(
-                    i, clock_rate, port, internal_event_range=internal_event_range
-                )
+            configs.append(
+                VMConfig(i, clock_rate, port, internal_event_range=internal_event_range)
             )
 
         # Connect the machines to each other
-        for i, machine in enumerate(machines):
-            other_machines = [
-                ("localhost", base_port + j) for j in range(num_machines) if j != i
+        for config in configs:
+            config.other_machines = [
+                machine_address(other.port) for other in configs if other is not config
             ]
-            machine.other_machines = other_machines
 
         # Start all machines in separate processes
-        for machine in machines:
-            process = multiprocessing.Process(
-                target=run_machine, args=(machine, duration_seconds)
-            )
+        for config in configs:
+            process = ctx.Process(target=run_machine, args=(config, duration_seconds))
             processes.append(process)
             process.start()
 
-        # Wait for all processes to finish
-        for process in processes:
-            process.join()
+        # Wait on whichever machine exits next, so a crash stops the rest
+        # straight away instead of after every other machine has finished
+        remaining = {process.sentinel: i for i, process in enumerate(processes)}
+        while remaining:
+            for sentinel in multiprocessing.connection.wait(list(remaining)):
+                i = remaining.pop(sentinel)
+                processes[i].join()
+                if processes[i].exitcode != 0:
+                    print(
+                        f"Machine {i} exited with code {processes[i].exitcode}; "
+                        "stopping the others"
+                    )
+                    remaining.clear()
+                    break
 
         # Give a small delay to ensure all file operations are complete
         time.sleep(0.1)
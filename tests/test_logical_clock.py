@@ -1,11 +1,31 @@
 import pytest
 import socket
+import asyncio
 import multiprocessing
 import time
 import os
 import shutil
-from queue import Empty
-from logical_clock_simulation import VirtualMachine, run_simulation
+import numpy as np
+import pandas as pd
+from dataclasses import asdict
+from collections import deque
+from analyze_results import parse_event_file, parse_log_file
+from decode_log import format_event
+from logical_clock_simulation import (
+    BROADCAST_PORT,
+    CLOCK_MESSAGE,
+    EVENT_DTYPE,
+    EVT_INTERNAL,
+    EVT_RECV,
+    EVT_SEND,
+    EventLog,
+    VMConfig,
+    VirtualMachine,
+    address_port,
+    read_event_records,
+    run_simulation,
+    unix_socket_path,
+)
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -70,8 +90,8 @@ def test_vm_initialization(vm):
     assert vm.machine_id == 1
     assert vm.clock_rate == 1
     assert vm.port == 5001
-    assert vm.logical_clock.value == 0
-    assert isinstance(vm.message_queue, multiprocessing.queues.Queue)
+    assert vm.logical_clock == 0
+    assert isinstance(vm.message_queue, deque)
     assert len(vm.other_machines) == 2
     assert vm.other_machines == [("localhost", 5002), ("localhost", 5003)]
 
@@ -79,34 +99,30 @@ def test_vm_initialization(vm):
 def test_logical_clock_update(vm):
     """Test logical clock updates"""
     # Test internal event update
-    initial_clock = vm.logical_clock.value
+    initial_clock = vm.logical_clock
     vm.update_logical_clock()
-    assert vm.logical_clock.value == initial_clock + 1
+    assert vm.logical_clock == initial_clock + 1
 
     # Test update with received time less than current
-    with vm.logical_clock.get_lock():
-        vm.logical_clock.value = 5
+    vm.logical_clock = 5
     vm.update_logical_clock(received_time=3)
-    assert vm.logical_clock.value == 6  # Should be max(5,3) + 1
+    assert vm.logical_clock == 6  # Should be max(5,3) + 1
 
     # Test update with received time greater than current
-    with vm.logical_clock.get_lock():
-        vm.logical_clock.value = 5
+    vm.logical_clock = 5
     vm.update_logical_clock(received_time=10)
-    assert vm.logical_clock.value == 11  # Should be max(5,10) + 1
+    assert vm.logical_clock == 11  # Should be max(5,10) + 1
 
 
 def test_message_queue(vm):
     """Test message queue functionality"""
-    # For multiprocessing Queue, we need to use get with timeout
-    test_message = (5, ("localhost", 5002))
-    vm.message_queue.put(test_message)
+    # Messages are (logical clock, source port)
+    vm.message_queue.append((5, 5002))
+    assert len(vm.message_queue) == 1
+    assert vm.message_queue.popleft() == (5, 5002)
 
-    try:
-        received = vm.message_queue.get(timeout=1)
-        assert received == test_message
-    except Empty:
-        pytest.fail("Failed to get message from queue")
+    with pytest.raises(IndexError):
+        vm.message_queue.popleft()
 
 
 def test_socket_binding(vm):
@@ -131,42 +147,127 @@ def test_multiple_machines():
     vm2.client_socket.close()
 
 
+def test_machine_from_config():
+    """Test building a machine from the config handed to its process"""
+    config = VMConfig(1, 2, 5001, [("localhost", 5002)], (3, 8))
+    vm = VirtualMachine(**asdict(config))
+
+    assert vm.machine_id == 1
+    assert vm.clock_rate == 2
+    assert vm.other_machines == [("localhost", 5002)]
+    assert vm.internal_event_range == (3, 8)
+    assert vm.server_socket.getsockname() == ("127.0.0.1", 5001)
+
+    vm.server_socket.close()
+    vm.client_socket.close()
+
+
 def test_message_sending(connected_vms, clean_logs):
     """Test sending messages between two machines"""
     vm1, vm2 = connected_vms
+    initial_clock = vm1.logical_clock
 
-    # Start receiver process for vm2
-    vm2.running.value = True
-    receiver_process = multiprocessing.Process(target=vm2.receive_messages)
-    receiver_process.daemon = True
-    receiver_process.start()
-
-    # Give some time for the receiver to start
-    time.sleep(0.1)
+    async def exchange():
+        # Start receiving for vm2 on this event loop
+        vm2.start_receiving()
+        try:
+            # Send message from vm1 to vm2
+            vm1.send_message(("localhost", 5002))
 
-    # Send message from vm1 to vm2
-    initial_clock = vm1.logical_clock.value
-    vm1.send_message(("localhost", 5002))
+            # Give the loop up to a second to receive the message
+            for _ in range(100):
+                if vm2.message_queue:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            vm2.stop_receiving()
 
-    # Give some time for message to be received
-    time.sleep(0.1)
+    asyncio.run(exchange())
 
     # Check that vm1's clock was incremented
-    assert vm1.logical_clock.value == initial_clock + 1
+    assert vm1.logical_clock == initial_clock + 1
 
     # Check that vm2 received the message
-    try:
-        received_clock, addr = vm2.message_queue.get(timeout=1)
-        # We only care that we received the message with the correct clock value
-        # The source port might be random since it's from an ephemeral port
-        assert received_clock == initial_clock
-    except Empty:
+    if not vm2.message_queue:
         pytest.fail("No message received")
+    received_clock, source_port = vm2.message_queue.popleft()
+    # We only care that we received the message with the correct clock value
+    # The source port might be random since it's from an ephemeral port
+    assert received_clock == initial_clock
 
-    # Cleanup
-    vm2.running.value = False
-    receiver_process.terminate()
-    receiver_process.join(timeout=1.0)
+
+def test_unix_transport():
+    """Test that machines can exchange messages over unix datagram sockets"""
+    vm1 = VirtualMachine(1, 1, 5011, transport="unix")
+    vm2 = VirtualMachine(2, 1, 5012, transport="unix")
+    vm1.other_machines = [vm2.address]
+
+    try:
+        vm1.send_message(vm2.address)
+        vm2.server_socket.settimeout(1)
+        data, addr = vm2.server_socket.recvfrom(1024)
+        assert CLOCK_MESSAGE.unpack(data)[0] == 0
+        assert address_port(addr) == 5011
+        assert address_port(vm2.address) == 5012
+    finally:
+        for machine in (vm1, vm2):
+            machine.server_socket.close()
+            machine.client_socket.close()
+            for path in machine._socket_paths():
+                os.unlink(path)
+
+
+def test_unix_unknown_sender(tmp_path):
+    """Test that a datagram from an unrecognised unix socket is dropped"""
+    vm = VirtualMachine(1, 1, 5011, transport="unix")
+    stranger = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    stranger.bind(str(tmp_path / "stranger.sock"))
+    try:
+        stranger.sendto(CLOCK_MESSAGE.pack(7), vm.address)
+        vm.client_socket.sendto(CLOCK_MESSAGE.pack(8), vm.address)
+        vm.server_socket.setblocking(False)
+        vm._receive_messages()
+        assert list(vm.message_queue) == [(8, 5011)]
+    finally:
+        stranger.close()
+        vm.server_socket.close()
+        vm.client_socket.close()
+        for path in vm._socket_paths():
+            os.unlink(path)
+
+
+def test_unix_send_to_stopped_peer():
+    """Test that sending to a unix peer whose socket is gone drops the message"""
+    vm = VirtualMachine(1, 1, 5011, transport="unix")
+    try:
+        # No machine is bound on port 5019
+        vm.send_message(unix_socket_path(5019))
+        assert vm.logical_clock == 1
+    finally:
+        vm.server_socket.close()
+        vm.client_socket.close()
+        for path in vm._socket_paths():
+            os.unlink(path)
+
+
+def test_broadcast_message(vm):
+    """Test that a broadcast reaches every peer as a single clock tick"""
+    peers = []
+    for port in (5002, 5003):
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.bind(("localhost", port))
+        peer.settimeout(1)
+        peers.append(peer)
+
+    try:
+        vm.broadcast_message()
+        assert vm.logical_clock == 1
+        for peer in peers:
+            data, _ = peer.recvfrom(1024)
+            assert CLOCK_MESSAGE.unpack(data)[0] == 0
+    finally:
+        for peer in peers:
+            peer.close()
 
 
 def test_edge_cases():
@@ -179,6 +280,11 @@ def test_edge_cases():
     with pytest.raises(ValueError):
         VirtualMachine(1, 1, 65536)
 
+    # Test with internal event ranges that can't be drawn from
+    for internal_event_range in [(0, 10), (5, 4), (4, 256)]:
+        with pytest.raises(ValueError):
+            VirtualMachine(1, 1, 5001, internal_event_range=internal_event_range)
+
     # Test with invalid clock rate
     vm = VirtualMachine(1, 0, 5001)
     assert vm.clock_rate == 0
@@ -194,6 +300,170 @@ def test_internal_event_range():
     vm.client_socket.close()
 
 
+def test_machines_draw_independent_actions(vm):
+    """Test that each machine seeds its own generator on first use"""
+    assert vm._rng is None
+    other = VirtualMachine(2, 1, 5002)
+    try:
+        actions = [vm._next_action() for _ in range(100)]
+        other_actions = [other._next_action() for _ in range(100)]
+        assert actions != other_actions
+    finally:
+        other.server_socket.close()
+        other.client_socket.close()
+
+
+def test_next_action_range(vm):
+    """Test that buffered random actions stay within 1-10"""
+    actions = [vm._next_action() for _ in range(1000)]
+    assert all(1 <= action <= 10 for action in actions)
+    assert all(isinstance(action, int) for action in actions)
+
+
+def test_internal_event_range_sets_action_range():
+    """Test that the top of internal_event_range bounds the random actions"""
+    vm = VirtualMachine(1, 1, 5001, internal_event_range=(4, 5))
+    actions = [vm._next_action() for _ in range(1000)]
+    assert set(actions) <= {1, 2, 3, 4, 5}
+    assert len(vm._build_dispatch()) == 6
+
+    vm.server_socket.close()
+    vm.client_socket.close()
+
+
+def test_dispatch_table(vm):
+    """Test that actions map to sends only when there are peers to send to"""
+    dispatch = vm._build_dispatch()
+    assert len(dispatch) == 11
+    assert dispatch[1].args == (("localhost", 5002),)
+    assert dispatch[2].args == (("localhost", 5003),)
+    assert dispatch[3] == vm.broadcast_message
+    assert all(dispatch[action] == vm.internal_event for action in range(4, 11))
+
+    vm.other_machines = [("localhost", 5002)]
+    dispatch = vm._build_dispatch()
+    assert dispatch[2] == vm.internal_event
+    assert dispatch[3] == vm.internal_event
+
+
+def test_dispatched_events_use_tick_time(vm, tmp_path):
+    """Test that dispatched events log the system time the tick read"""
+    vm.events = EventLog(tmp_path / "machine_1.bin")
+    dispatch = vm._build_dispatch()
+    dispatch[4](123.5)
+    dispatch[1](124.5)
+    vm.events.close()
+
+    records = np.fromfile(tmp_path / "machine_1.bin", dtype=EVENT_DTYPE)
+    assert list(records["system_time"]) == [123.5, 124.5]
+
+
+def test_event_log_records(tmp_path):
+    """Test that event records round-trip through the binary log"""
+    path = tmp_path / "machine_1.bin"
+    event_log = EventLog(path)
+    event_log.log(EVT_SEND, 5002, 3, 100.5)
+    event_log.log(EVT_RECV, 5003, 7, 101.25, queue_length=2)
+    event_log.close()
+
+    records = np.fromfile(path, dtype=EVENT_DTYPE)
+    assert len(records) == 2
+    assert list(records["event"]) == [EVT_SEND, EVT_RECV]
+    assert list(records["port"]) == [5002, 5003]
+    assert list(records["logical_clock"]) == [3, 7]
+    assert list(records["system_time"]) == [100.5, 101.25]
+    assert records["queue_length"][1] == 2
+
+
+def test_event_log_grows(tmp_path, monkeypatch):
+    """Test that records past the initial file size are kept and the file is trimmed"""
+    monkeypatch.setattr(EventLog, "_INITIAL_SIZE", 10 * EVENT_DTYPE.itemsize)
+    path = tmp_path / "machine_1.bin"
+    event_log = EventLog(path)
+    count = 35
+    for clock in range(count):
+        event_log.log(EVT_SEND, 5002, clock, float(clock))
+    event_log.close()
+
+    assert os.path.getsize(path) == count * EVENT_DTYPE.itemsize
+    records = np.fromfile(path, dtype=EVENT_DTYPE)
+    assert (records["logical_clock"] == np.arange(count)).all()
+
+
+def test_parse_log_file(tmp_path):
+    """Test parsing text logs with both the '.f' and '.%f' timestamp suffixes, skipping malformed events"""
+    log_path = tmp_path / "machine_0.log"
+    log_path.write_text(
+        "2025-03-05 14:29:21.f - Starting machine 0 with clock rate 1 ticks/second\n"
+        "2025-03-05 14:29:21.f - Internal event range: (4, 10)\n"
+        "2025-03-05 14:29:22.f - SEND to 5002 - System time: 1741202962.072218, Logical clock: 1\n"
+        "2025-03-05 14:29:23.f - RECEIVE from 56314 - System time: 1741202963.077844, Queue length: 3, Logical clock: 4\n"
+        "2026-10-15 21:56:43.%f - INTERNAL EVENT - System time: 1792101403.189464, Logical clock: 5\n"
+        "2026-10-15 21:56:43.%f - INTERNAL FOO - System time: 1792101403.189464, Logical clock: 99\n"
+        "2026-10-15 21:56:44.%f - SEND to 5001 - System time: 1792101404.189464, Logical clock: 6\n"
+        "2026-10-15 21:56:45.%f - Machine 0 shutdown\n"
+    )
+
+    df = parse_log_file(log_path)
+    assert len(df) == 4
+    assert list(df.columns) == [
+        "timestamp",
+        "system_time",
+        "event_type",
+        "logical_clock",
+        "target",
+        "source",
+        "queue_length",
+    ]
+    assert list(df["timestamp"]) == [
+        "2025-03-05 14:29:22",
+        "2025-03-05 14:29:23",
+        "2026-10-15 21:56:43",
+        "2026-10-15 21:56:44",
+    ]
+    assert list(df["event_type"]) == ["SEND", "RECEIVE", "INTERNAL", "SEND"]
+    assert list(df["logical_clock"]) == [1, 4, 5, 6]
+    assert list(df["system_time"]) == [
+        1741202962.072218,
+        1741202963.077844,
+        1792101403.189464,
+        1792101404.189464,
+    ]
+    np.testing.assert_array_equal(df["target"], [5002, np.nan, np.nan, 5001])
+    np.testing.assert_array_equal(df["source"], [np.nan, 56314, np.nan, np.nan])
+    np.testing.assert_array_equal(df["queue_length"], [np.nan, 3, np.nan, np.nan])
+
+
+def test_event_log_read_back(tmp_path):
+    """Test that binary logs load for analysis and decode to text that parses the same"""
+    path = tmp_path / "machine_1.bin"
+    event_log = EventLog(path)
+    event_log.log(EVT_INTERNAL, 0, 1, 1000.25)
+    event_log.log(EVT_SEND, 5002, 2, 1001.5)
+    event_log.log(EVT_SEND, BROADCAST_PORT, 3, 1002.75)
+    event_log.log(EVT_RECV, 5003, 9, 1003.0, queue_length=2)
+    event_log.close()
+    # The zeroed tail left by a machine killed before closing its log
+    with open(path, "ab") as f:
+        f.write(bytes(3 * EVENT_DTYPE.itemsize))
+
+    df = parse_event_file(path)
+    assert list(df["event_type"]) == ["INTERNAL", "SEND", "SEND", "RECEIVE"]
+    assert list(df["logical_clock"]) == [1, 2, 3, 9]
+    np.testing.assert_array_equal(df["target"], [np.nan, 5002, 0, np.nan])
+    np.testing.assert_array_equal(df["source"], [np.nan, np.nan, np.nan, 5003])
+    np.testing.assert_array_equal(df["queue_length"], [np.nan, np.nan, np.nan, 2])
+
+    # Decoded text parses back to the same rows; timestamps are rendered in
+    # local time, so compare everything else
+    lines = [format_event(record) for record in read_event_records(path)]
+    assert " - SEND to 0 - " in lines[2]
+    log_path = tmp_path / "machine_1.log"
+    log_path.write_text("\n".join(lines) + "\n")
+    columns = ["system_time", "event_type", "logical_clock", "target", "source", "queue_length"]
+    pd.testing.assert_frame_equal(parse_log_file(log_path)[columns], df[columns])
+
+
 def test_short_simulation(clean_logs):
     """Test running a short simulation"""
     # Run a very short simulation with 2 machines
@@ -205,6 +475,8 @@ def test_short_simulation(clean_logs):
     # Check that log files were created
     assert os.path.exists("logs/machine_0.log")
     assert os.path.exists("logs/machine_1.log")
+    assert os.path.exists("logs/machine_0.bin")
+    assert os.path.exists("logs/machine_1.bin")
 
     # Check log file contents
     with open("logs/machine_0.log", "r", encoding="utf-8") as f:
@@ -213,6 +485,19 @@ def test_short_simulation(clean_logs):
         assert "shutdown" in log_contents
 
 
+def test_simulation_stops_when_a_machine_fails(clean_logs):
+    """Test that one machine failing to start ends the whole simulation early"""
+    # Machine 1 can't bind its port, so its process exits with an error
+    blocker = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    blocker.bind(("localhost", 5001))
+    try:
+        start = time.monotonic()
+        run_simulation(duration_seconds=10, num_machines=2, max_clock_rate=2)
+        assert time.monotonic() - start < 5
+    finally:
+        blocker.close()
+
+
 @pytest.mark.skip(reason="Long running test")
 def test_full_simulation(clean_logs):
     """Test running a full simulation (skipped by default)"""